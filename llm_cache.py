@@ -0,0 +1,113 @@
+import hashlib
+import json
+import time
+
+import numpy as np
+
+
+def context_key(messages):
+    # Hash the roles and contents of the given turns so a cached answer is
+    # only reused when the preceding conversation is the same.
+    payload = json.dumps(
+        [(m["role"], m["content"]) for m in messages], ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def request_key(**request):
+    payload = json.dumps(request, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ExactCache:
+    def __init__(self, ttl=3600, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (expires_at, value), in insertion order
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            # Every entry has the same TTL, so the first one expires soonest.
+            del self._entries[next(iter(self._entries))]
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+
+
+class SemanticCache:
+    def __init__(
+        self,
+        client,
+        model="text-embedding-3-small",
+        threshold=0.92,
+        ttl=3600,
+        max_entries=1000,
+    ):
+        self.client = client
+        self.model = model
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # context key -> list of (expires_at, unit embedding, content)
+        self._entries = {}
+        self._size = 0
+
+    async def embed(self, text):
+        response = await self.client.embeddings.create(model=self.model, input=text)
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def lookup(self, embedding, key):
+        entries = self._entries.get(key)
+        if not entries:
+            return None
+
+        now = time.monotonic()
+        live = [entry for entry in entries if entry[0] > now]
+        self._size -= len(entries) - len(live)
+        if not live:
+            del self._entries[key]
+            return None
+        self._entries[key] = live
+
+        # Embeddings are unit length, so the dot product is the cosine similarity.
+        similarities = np.stack([entry[1] for entry in live]) @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.threshold:
+            return None
+        return live[best][2]
+
+    def store(self, embedding, key, content):
+        if self._size >= self.max_entries:
+            self._evict()
+        self._entries.setdefault(key, []).append(
+            (time.monotonic() + self.ttl, embedding, content)
+        )
+        self._size += 1
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in list(self._entries):
+            live = [entry for entry in self._entries[key] if entry[0] > now]
+            if live:
+                self._entries[key] = live
+            else:
+                del self._entries[key]
+        self._size = sum(len(entries) for entries in self._entries.values())
+
+        # Still full: drop the entries closest to expiring.
+        while self._size >= self.max_entries:
+            key = min(self._entries, key=lambda k: self._entries[k][0][0])
+            self._entries[key].pop(0)
+            if not self._entries[key]:
+                del self._entries[key]
+            self._size -= 1
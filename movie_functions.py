@@ -1,4 +1,5 @@
 import os
+import re
 import requests
 from serpapi import GoogleSearch
 import os
@@ -35,6 +36,22 @@ def get_now_playing_movies():
     return formatted_movies
 
 
+MOVIE_TITLE_ID_RE = re.compile(r"\*\*Title:\*\* (.*)\n\*\*Movie ID:\*\* (.*)")
+
+
+def compact_now_playing_movies(formatted_movies):
+    # Reduce a get_now_playing_movies() listing to movie IDs and titles.
+    titles = MOVIE_TITLE_ID_RE.findall(formatted_movies)
+    if not titles:
+        return formatted_movies
+
+    compact_movies = "Movies now playing (ID: title):\n"
+    for title, movie_id in titles:
+        compact_movies += f"- {movie_id}: {title}\n"
+
+    return compact_movies
+
+
 def get_showtimes(title, location):
     params = {
         "api_key": os.getenv("SERP_API_KEY"),
@@ -72,6 +89,10 @@ def get_showtimes(title, location):
     return formatted_showtimes
 
 
+def confirm_ticket_purchase(theater, movie, showtime):
+    return f"The user has confirmed their purchase for {movie} at {theater} for {showtime}."
+
+
 def buy_ticket(theater, movie, showtime):
     return f"Ticket purchased for {movie} at {theater} for {showtime}."
 